@@ -58,27 +58,65 @@
 #
 
 import abc
-import argparse
-import collections
 import datetime
+import functools
 import hashlib
+import heapq
 import itertools
+import mmap
 import operator
 import os
+import re
+import shutil
 import subprocess
 import sys
-import tempfile
+
+
+_GIT_DIR_CACHE = {}
+
+def check_is_git_repo_marker(git_path):
+    # A ".git" directory must contain HEAD, a ".git" file
+    # (worktrees, submodules) must start with "gitdir:".
+    # Empty or stale ".git" entries are not considered.
+    if os.path.isdir(git_path):
+        return os.path.isfile(os.path.join(git_path, "HEAD"))
+
+    try:
+        with open(git_path, "rb") as fh:
+            return fh.read(7) == b"gitdir:"
+    except OSError:
+        return False
+# --- end of check_is_git_repo_marker (...) ---
 
 
 def check_is_git_dir(dirpath):
-    proc = subprocess.run(
-        ["git", "rev-parse", "--show-toplevel"],
-        cwd    = dirpath,
-        stdout = subprocess.DEVNULL,
-        stderr = subprocess.DEVNULL,
-    )
+    # Looks for a ".git" dir (or file, for worktrees and submodules)
+    # in dirpath and its parent directories instead of running git.
+    dirpath = os.path.realpath(dirpath)
 
-    return (proc.returncode == getattr(os, "EX_OK", 0))
+    try:
+        return _GIT_DIR_CACHE[dirpath]
+    except KeyError:
+        pass
+
+    is_git_dir = False
+    d = dirpath
+    while True:
+        git_path = os.path.join(d, ".git")
+
+        if os.path.lexists(git_path):
+            # the nearest ".git" entry decides, like git itself
+            is_git_dir = check_is_git_repo_marker(git_path)
+            break
+
+        parent = os.path.dirname(d)
+        if parent == d:
+            break
+        d = parent
+    # --
+
+    _GIT_DIR_CACHE[dirpath] = is_git_dir
+    return is_git_dir
 # --- end of check_is_git_dir (...) ---
 
 
@@ -100,9 +138,17 @@ class BuildType(object, metaclass=abc.ABCMeta):
 
     BUILD_CONFIG_FILENAME = ".config"
 
-    def get_default_config_name(self):
+    # names of files/dirs in the config store dir that should be considered:
+    # not hidden, not "files", not README*, not *.tmp
+    CONFIG_NAME_RE = re.compile(r'^(?![.]|README|files$)(?!.*[.]tmp$).')
+
+    # max. number of same-size backup files hashed at once in run_backup()
+    BACKUP_HASH_BATCH_SIZE = 8
+
+    @functools.cached_property
+    def default_config_name(self):
         return "latest"
-    # --- end of get_default_config_name (...) ---
+    # --- end of default_config_name ---
 
     def get_default_backup_name(self):
         date_today = datetime.date.today()
@@ -110,21 +156,24 @@ class BuildType(object, metaclass=abc.ABCMeta):
         return date_today.strftime("config_%Y-%m-%d")
     # --- end of get_default_backup_name (...) ---
 
-    def get_build_config_file_path(self):
+    @functools.cached_property
+    def build_config_file_path(self):
         return os.path.join(self.info.build_dir, self.BUILD_CONFIG_FILENAME)
-    # --- end of get_build_config_file_path (...) ---
+    # --- end of build_config_file_path ---
 
     def __init__(self, info, ckey=None):
         super().__init__()
         self.info = info
         self.ckey = (ckey or self.NAME)
 
-    def get_config_dir_path(self):
+    @property
+    def config_dir_path(self):
+        # not cached, depends on ckey (may be changed by detect())
         if self.ckey:
             return os.path.join(self.info.config_root, self.ckey)
         else:
             return self.info.config_root
-    # --- end of get_config_dir_path (...) ---
+    # --- end of config_dir_path ---
 
     @abc.abstractmethod
     def detect(self, guess_ckey=False):
@@ -134,7 +183,24 @@ class BuildType(object, metaclass=abc.ABCMeta):
         pass
 
     def prepare_build(self):
-        pass
+        # May return a subprocess.Popen object for a still running
+        # build preparation command, see wait_prepare_build().
+        return None
+
+    def wait_prepare_build(self, proc):
+        if proc is not None:
+            returncode = proc.wait()
+            if returncode:
+                raise subprocess.CalledProcessError(returncode, proc.args)
+        # --
+    # --- end of wait_prepare_build (...) ---
+
+    def abort_prepare_build(self, proc):
+        # waits for the process without checking its exit code,
+        # for use while another exception is being handled
+        if proc is not None:
+            proc.wait()
+    # --- end of abort_prepare_build (...) ---
 
     def prepare_build_outoftree(self):
         build_dir = self.info.build_dir
@@ -143,7 +209,7 @@ class BuildType(object, metaclass=abc.ABCMeta):
             os.makedirs(build_dir, exist_ok=True)
             should_init = True
 
-        elif not os.path.isfile(os.path.join(self.get_build_config_file_path())):
+        elif not os.path.isfile(self.build_config_file_path):
             # FIXME empty dir or missing config file, what is more appropriate?
             should_init = True
 
@@ -152,25 +218,34 @@ class BuildType(object, metaclass=abc.ABCMeta):
         # --
 
         if should_init:
-            subprocess.run(
-                ["make", "-C", self.info.src_dir, f"O={build_dir}", "defconfig"],
-                cwd   = self.info.src_dir,
-                check = True,
+            make_argv = ["make", "--no-print-directory"]
+
+            # parallel jobs for sub-makes,
+            # unless MAKEFLAGS already has a jobs/jobserver setting
+            make_flags = os.environ.get("MAKEFLAGS", "").partition(" -- ")[0]
+            if not any(
+                (w.startswith("-j") or w.startswith("--jobs"))
+                for w in make_flags.split()
+            ):
+                make_argv.append("-j{:d}".format(os.cpu_count() or 1))
+            # --
+
+            make_argv.extend(
+                ["-C", self.info.src_dir, f"O={build_dir}", "defconfig"]
             )
+
+            # not waited for here, see wait_prepare_build()
+            return subprocess.Popen(make_argv, cwd=self.info.src_dir)
         # --
+
+        return None
     # --- end of prepare_build_outoftree (...) ---
 
     def list_config_dir(self, config_dir):
-        def check_name(arg):
-            # FIXME: regexp or so
-            return (
-                arg
-                and (arg[0] != ".")
-                and (arg != "files")
-                and (not arg.startswith("README"))
-                and (not arg.endswith(".tmp"))
-            )
-        # ---
+        # Returns a 2-tuple (regular files map, symlinks map),
+        # both sorted by name.
+        check_name = self.CONFIG_NAME_RE.match
+        lmap = {}
 
         def scan_config_dir(config_dir, prefix=''):
             with os.scandir(config_dir) as dh:
@@ -178,7 +253,13 @@ class BuildType(object, metaclass=abc.ABCMeta):
                     if not check_name(entry.name):
                         pass
 
-                    elif entry.is_file(follow_symlinks=True):
+                    elif entry.is_symlink():
+                        # symlinks ("latest", aliases) are collected
+                        # without stat()ing their target,
+                        # see resolve_config_link()
+                        lmap[prefix + entry.name] = entry
+
+                    elif entry.is_file(follow_symlinks=False):
                         yield ((prefix + entry.name), entry)
 
                     elif entry.is_dir(follow_symlinks=False):
@@ -190,42 +271,116 @@ class BuildType(object, metaclass=abc.ABCMeta):
                     # -- end if
         # ---
 
-        return {key: e for key, e in scan_config_dir(config_dir)}
+        # sorted by name, dicts preserve insertion order
+        cmap = dict(
+            sorted(scan_config_dir(config_dir), key=operator.itemgetter(0))
+        )
+        lmap = dict(sorted(lmap.items(), key=operator.itemgetter(0)))
+
+        return (cmap, lmap)
     # --- end of list_config_dir (...) ---
 
     def get_config_dir(self, verbose=True):
-        cdir = self.get_config_dir_path()
+        cdir = self.config_dir_path
 
         try:
-            cmap = self.list_config_dir(cdir)
+            cmap, lmap = self.list_config_dir(cdir)
         except FileNotFoundError:
             if verbose:
                 sys.stderr.write(
                     "config store directory missing: {}\n".format(cdir)
                 )
-            cmap = None
+            cmap, lmap = None, None
         # --
 
-        return (cdir, cmap)
+        return (cdir, cmap, lmap)
     # --- end of get_config_dir (...) ---
 
-    def copy_file(self, src, dst, *, bsize=2**14):
+    def copy_fd_data(self, src_fd, dst_fd, size, *, bsize=2**20):
+        # Try in-kernel copy methods first (copy_file_range, sendfile),
+        # fall back to copying via userspace buffers.
+        # Returns without error if all data has been copied.
+        remaining = size
+
+        if hasattr(os, "copy_file_range"):
+            try:
+                while remaining > 0:
+                    copied = os.copy_file_range(src_fd, dst_fd, remaining)
+                    if not copied:
+                        break
+                    remaining -= copied
+                # --
+            except OSError:
+                pass
+            # --
+
+            if remaining <= 0:
+                return
+        # --
+
+        if hasattr(os, "sendfile"):
+            try:
+                while remaining > 0:
+                    copied = os.sendfile(dst_fd, src_fd, None, remaining)
+                    if not copied:
+                        break
+                    remaining -= copied
+                # --
+            except OSError:
+                pass
+            # --
+
+            if remaining <= 0:
+                return
+        # --
+
+        # copy whatever is left (or the file grew in the meantime)
+        with open(src_fd, "rb", closefd=False) as src_fh, \
+             open(dst_fd, "wb", closefd=False) as dst_fh:
+            shutil.copyfileobj(src_fh, dst_fh, bsize)
+    # --- end of copy_fd_data (...) ---
+
+    def copy_file(self, src, dst, *, preserve_mtime=False):
         sys.stdout.write(f"{src} -> {dst}\n")
 
         dst_dir = os.path.dirname(dst)
 
         os.makedirs(dst_dir, exist_ok=True)
 
-        (tmp_fd, tmp_filepath) = tempfile.mkstemp(suffix=".tmp", dir=dst_dir, text=False)
+        tmp_filepath = f"{dst}.{os.getpid()}.tmp"
+        tmp_flags = (
+            os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW | os.O_CLOEXEC
+        )
+
+        try:
+            tmp_fd = os.open(tmp_filepath, tmp_flags, 0o644)
+        except FileExistsError:
+            # stale file (or symlink) from an earlier run with the same pid,
+            # remove it and try once more
+            os.unlink(tmp_filepath)
+            tmp_fd = os.open(tmp_filepath, tmp_flags, 0o644)
+        # --
         try:
             with open(src, 'rb') as fh:
-                block = fh.read(bsize)
-                while block:
-                    os.write(tmp_fd, block)
-                    block = fh.read(bsize)
+                src_fd = fh.fileno()
+                src_stat = os.fstat(src_fd)
+
+                if src_stat.st_size and hasattr(os, "posix_fallocate"):
+                    try:
+                        os.posix_fallocate(tmp_fd, 0, src_stat.st_size)
+                    except OSError:
+                        pass   # not supported by filesystem, ignore
                 # --
+
+                self.copy_fd_data(src_fd, tmp_fd, src_stat.st_size)
             # --
 
+            # in case the source file shrunk in the meantime
+            os.ftruncate(tmp_fd, os.lseek(tmp_fd, 0, os.SEEK_CUR))
+
+            if preserve_mtime:
+                os.utime(tmp_fd, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
             os.close(tmp_fd)
             tmp_fd = None
 
@@ -251,11 +406,14 @@ class BuildType(object, metaclass=abc.ABCMeta):
             get_entry_str = operator.attrgetter('name')
         # --
 
-        cdir, cmap = self.get_config_dir()
-        if not cmap:
+        cdir, cmap, lmap = self.get_config_dir()
+        if not (cmap or lmap):
             return False
 
-        items = sorted(cmap.items(), key=lambda kv: kv[0])
+        # files and symlinks, both already sorted by name
+        items = heapq.merge(
+            cmap.items(), lmap.items(), key=operator.itemgetter(0)
+        )
 
         if long_format:
             for name, entry in items:
@@ -268,31 +426,73 @@ class BuildType(object, metaclass=abc.ABCMeta):
 
     def run_config(self, name=None):
         if not name:
-            name = self.get_default_config_name()
+            name = self.default_config_name
 
         elif name[-1] == "/":
             # FIXME: proper directory detection maybe?
-            name = os.path.join(name, self.get_default_config_name())
+            name = os.path.join(name, self.default_config_name)
         # --
 
-        cdir, cmap = self.get_config_dir()
-        if not cmap:
+        # scan the config store dir while the build dir is being prepared
+        prepare_proc = self.prepare_build()
+        try:
+            cdir, cmap, lmap = self.get_config_dir()
+        except BaseException:
+            # keep the original exception (e.g. KeyboardInterrupt)
+            self.abort_prepare_build(prepare_proc)
+            raise
+        # --
+
+        self.wait_prepare_build(prepare_proc)
+
+        if not (cmap or lmap):
             return False
 
-        try:
-            cfile = cmap[name]
-        except KeyError:
+        if name in cmap:
+            cfile_path = cmap[name].path
+
+        elif name in lmap:
+            # symlinks ("latest", user-defined aliases)
+            cfile_path = self.resolve_config_link(cdir, name)
+
+        else:
+            cfile_path = None
+        # --
+
+        if cfile_path is None:
             sys.stderr.write("config file not found: {}\n".format(name))
             return False
 
-        bcfile = self.get_build_config_file_path()
-        self.copy_file(cfile.path, bcfile)
+        bcfile = self.build_config_file_path
+        self.copy_file(cfile_path, bcfile)
     # --- end of run_config (...) ---
 
-    def get_file_hash(self, filepath, *, bsize=2**14):
-        hashobj = hashlib.new("sha256")
-
+    def get_file_hash(self, filepath, *, bsize=2**20):
         with open(filepath, "rb") as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                # cannot mmap empty files
+                return hashlib.sha256().hexdigest()
+            # --
+
+            try:
+                mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                mm = None
+            # --
+
+            if mm is not None:
+                # hash the whole file as one contiguous buffer
+                with mm:
+                    return hashlib.sha256(mm).hexdigest()
+            # --
+
+            if hasattr(hashlib, "file_digest"):
+                # Python >= 3.11: read/update loop runs in C
+                return hashlib.file_digest(fh, "sha256").hexdigest()
+            # --
+
+            hashobj = hashlib.new("sha256")
+
             block = fh.read(bsize)
             while block:
                 hashobj.update(block)
@@ -302,6 +502,103 @@ class BuildType(object, metaclass=abc.ABCMeta):
         return hashobj.hexdigest()
     # --- end of get_file_hash (...) ---
 
+    def find_identical_file(self, file_hash, candidates, *, max_workers=4):
+        # Compares file_hash to the hashes of the candidate files,
+        # given as list of (key, path) tuples, and returns the key of the
+        # first (lowest index) identical file.  Returns None if there is
+        # no match.
+        #
+        # Multiple candidates get hashed in parallel
+        # (hashlib releases the GIL for larger buffers).
+        if not candidates:
+            return None
+
+        elif len(candidates) == 1:
+            key, path = candidates[0]
+            return (key if self.get_file_hash(path) == file_hash else None)
+        # --
+
+        # imported here, pulls in threading and logging
+        import concurrent.futures
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                (key, executor.submit(self.get_file_hash, path))
+                for key, path in candidates
+            ]
+
+            # wait in order, returns as soon as the lowest-index match is known
+            for key, future in futures:
+                if future.result() == file_hash:
+                    for _, other in futures:
+                        other.cancel()
+
+                    return key
+                # --
+            # --
+        # --
+
+        return None
+    # --- end of find_identical_file (...) ---
+
+    def resolve_config_link(self, cdir, name):
+        # Returns the path of the file the symlink <cdir>/<name> points to,
+        # or None if it is not a symlink to a regular file.
+        link_path = os.path.join(cdir, name)
+
+        try:
+            link_dst = os.readlink(link_path)
+        except OSError:
+            return None
+
+        # absolute link_dst replaces the dirname
+        cfile_path = os.path.join(os.path.dirname(link_path), link_dst)
+
+        return (cfile_path if os.path.isfile(cfile_path) else None)
+    # --- end of resolve_config_link (...) ---
+
+    def get_latest_config_name(self, cdir, subdir=""):
+        # Returns the name of the file the "latest" symlink
+        # in <cdir>/<subdir> points to (relative to cdir),
+        # or None if there is no such symlink.
+        link_dir = os.path.join(cdir, subdir)
+
+        try:
+            link_dst = os.readlink(
+                os.path.join(link_dir, self.default_config_name)
+            )
+        except OSError:
+            return None
+
+        if os.path.isabs(link_dst):
+            # not created by run_backup()
+            return None
+
+        name = os.path.normpath(os.path.join(subdir, link_dst))
+        if name.split(os.sep, 1)[0] == os.pardir:
+            # points outside of cdir
+            return None
+
+        return name
+    # --- end of get_latest_config_name (...) ---
+
+    def get_file_fingerprint(self, filepath, *, bsize=2**12):
+        # Returns the first and last <bsize> bytes of a file,
+        # which is cheap to compare before calculating a full hash.
+        with open(filepath, "rb") as fh:
+            head = fh.read(bsize)
+            if len(head) < bsize:
+                return head
+
+            size = os.fstat(fh.fileno()).st_size
+            if size > (2 * bsize):
+                fh.seek(size - bsize)
+            # --
+
+            return head + fh.read(bsize)
+        # --
+    # --- end of get_file_fingerprint (...) ---
+
     def run_backup(self, name=None):
         if not name:
             name = self.get_default_backup_name()
@@ -311,11 +608,23 @@ class BuildType(object, metaclass=abc.ABCMeta):
             name = os.path.join(name, self.get_default_backup_name())
         # --
 
-        bcfile = self.get_build_config_file_path()
-        bcfile_hash = self.get_file_hash(bcfile)
+        if os.path.basename(name) == self.default_config_name:
+            sys.stderr.write("invalid backup name: {}\n".format(name))
+            return False
+        # --
+
+        bcfile = self.build_config_file_path
+        bcfile_stat = os.stat(bcfile)
+        bcfile_fingerprint = None  # computed on first size match
         want_copy = False
 
-        cdir, cmap = self.get_config_dir(verbose=False)
+        cdir, cmap, lmap = self.get_config_dir(verbose=False)
+
+        if os.path.islink(os.path.join(cdir, name)):
+            # would replace the symlink itself
+            sys.stderr.write("invalid backup name (symlink): {}\n".format(name))
+            return False
+        # --
 
         if cmap is None:
             # cdir does not exist yet
@@ -334,31 +643,99 @@ class BuildType(object, metaclass=abc.ABCMeta):
             # --- end of fgen (...) ---
 
             basename = name
-            for name in fgen(basename):
-                if name not in cmap:
-                    want_copy = True
-                    break
 
-                else:
-                    cfile_hash = self.get_file_hash(cmap[name].path)
-                    if bcfile_hash == cfile_hash:
-                        sys.stdout.write(f"File not changed: {name}\n")
+            # fast path: "latest" points to a file of the basename series
+            # with the same size and mtime as the build config
+            latest_name = self.get_latest_config_name(
+                cdir, os.path.dirname(basename)
+            )
+
+            latest_entry = (
+                cmap.get(latest_name) if (
+                    latest_name and (
+                        (latest_name == basename)
+                        or latest_name.startswith(f"{basename}-r")
+                    )
+                ) else None
+            )
+
+            if latest_entry is not None:
+                # dangling "latest" links do not show up in cmap
+                latest_stat = latest_entry.stat()
+
+                if (
+                    (latest_stat.st_size == bcfile_stat.st_size)
+                    and (latest_stat.st_mtime_ns == bcfile_stat.st_mtime_ns)
+                ):
+                    sys.stdout.write(f"File not changed: {latest_name}\n")
+                    return
+            # --
+
+            # Walk the name series in batches of up to <batch_size> files
+            # that pass the cheap checks and compare their hashes,
+            # stop at the first batch with an identical file or
+            # at the first free name (used for storing a new file).
+            batch_size  = self.BACKUP_HASH_BATCH_SIZE
+            bcfile_hash = None
+            names       = fgen(basename)
+
+            while True:
+                candidates = []
+
+                for name in names:
+                    if name in lmap:
+                        # occupied by a symlink, never replaced
+                        pass
+
+                    elif name not in cmap:
+                        want_copy = True
+                        break
+
+                    elif cmap[name].stat().st_size != bcfile_stat.st_size:
+                        # size differs, file content cannot be the same
+                        pass
+
+                    else:
+                        if bcfile_fingerprint is None:
+                            bcfile_fingerprint = self.get_file_fingerprint(bcfile)
+
+                        cfile_path = cmap[name].path
+
+                        if self.get_file_fingerprint(cfile_path) == bcfile_fingerprint:
+                            candidates.append((name, cfile_path))
+
+                            if len(candidates) >= batch_size:
+                                break
+                    # -- end if
+                # -- end for
+
+                if candidates:
+                    if bcfile_hash is None:
+                        bcfile_hash = self.get_file_hash(bcfile)
+
+                    same_name = self.find_identical_file(bcfile_hash, candidates)
+
+                    if same_name is not None:
+                        sys.stdout.write(f"File not changed: {same_name}\n")
                         want_copy = False
                         break
-                # -- end if
-            # -- end of infinite loop
+                # --
+
+                if want_copy:
+                    break
+            # -- end while
         # -- end if
 
         cfile = os.path.join(cdir, name)
         cfile_link = os.path.join(
             os.path.dirname(cfile),   # not necessarily eq cdir (subdir..)
-            self.get_default_config_name()
+            self.default_config_name
         )
 
         if want_copy:
             git_changed = []
 
-            self.copy_file(bcfile, cfile)
+            self.copy_file(bcfile, cfile, preserve_mtime=True)
             git_changed.append(cfile)
 
             # FIXME FIXME FIXME hyper atomic
@@ -379,18 +756,31 @@ class BuildType(object, metaclass=abc.ABCMeta):
     # --- end of run_backup (...) ---
 
     def run_git_commit_file(self, dirpath, filepaths, commit_text):
-        subprocess.run(
-            (["git", "add"] + filepaths),
-            cwd   = dirpath,
-            check = True,
+        self.git_commit_batch(dirpath, [(filepaths, commit_text)])
+    # --- end of run_git_commit_file (...) ---
+
+    def git_commit_batch(self, dirpath, commits):
+        # stage all files with a single git invocation,
+        # then create one commit per (filepaths, commit_text) item
+        all_filepaths = list(
+            dict.fromkeys(itertools.chain.from_iterable(f for f, _ in commits))
         )
 
+        if not all_filepaths:
+            return
+
         subprocess.run(
-            (["git", "commit", "-m", commit_text] + filepaths),
-            cwd   = dirpath,
+            (["git", "-C", dirpath, "add", "--"] + all_filepaths),
             check = True,
         )
-    # --- end of run_git_commit_file (...) ---
+
+        for filepaths, commit_text in commits:
+            subprocess.run(
+                (["git", "-C", dirpath, "commit", "-m", commit_text, "--"] + list(filepaths)),
+                check = True,
+            )
+        # --
+    # --- end of git_commit_batch (...) ---
 
 # --- end of BuildType ---
 
@@ -410,7 +800,7 @@ class LinuxBuildType(BuildType):
     # --- end of detect (...) ---
 
     def prepare_build(self):
-        self.prepare_build_outoftree()
+        return self.prepare_build_outoftree()
 
 # --- end of LinuxBuildType ---
 
@@ -431,19 +821,27 @@ class BuildrootBuildType(BuildType):
     # --- end of detect (...) ---
 
     def prepare_build(self):
-        self.prepare_build_outoftree()
+        prepare_proc = self.prepare_build_outoftree()
 
         # Additionally, create a symlink <build>/local-files -> <config>/files
-        cfiles_dir = os.path.join(self.get_config_dir_path(), "files")
+        cfiles_dir = os.path.join(self.config_dir_path, "files")
         bfiles_dir = os.path.join(self.info.build_dir, "local-files")
 
         try:
-            os.lstat(bfiles_dir)
+            try:
+                os.lstat(bfiles_dir)
 
-        except FileNotFoundError:
-            if os.path.isdir(cfiles_dir):
-                os.symlink(cfiles_dir, bfiles_dir)
+            except FileNotFoundError:
+                if os.path.isdir(cfiles_dir):
+                    os.symlink(cfiles_dir, bfiles_dir)
+            # --
+
+        except BaseException:
+            self.abort_prepare_build(prepare_proc)
+            raise
         # --
+
+        return prepare_proc
     # --- end of prepare_build (...) ---
 
 # --- end of BuildrootBuildType ---
@@ -463,7 +861,6 @@ class GenericBuildType(BuildType):
     def detect(self, guess_ckey=False):
         if guess_ckey:
             self.ckey = os.path.basename(self.info.build_dir).strip(".").partition(".")[0]
-            pass
         # --
         return True
 
@@ -478,8 +875,8 @@ KNOWN_BUILD_TYPES = [
 ]
 
 
-def get_build_type_map():
-    bmap = collections.OrderedDict()
+def _build_build_type_map():
+    bmap = {}
     bmap_alias = {}
 
     for btype_cls in KNOWN_BUILD_TYPES:
@@ -493,27 +890,40 @@ def get_build_type_map():
     # --
 
     return (bmap, bmap_alias)
-# --- end of get_build_type_map (...) ---
+# --- end of _build_build_type_map (...) ---
+
+BUILD_TYPE_MAP, BUILD_TYPE_ALIAS_MAP = _build_build_type_map()
 
 
 def main(prog, argv):
-    (build_type_map, build_type_alias_map) = get_build_type_map()
+    build_type_map       = BUILD_TYPE_MAP
+    build_type_alias_map = BUILD_TYPE_ALIAS_MAP
 
     default_config_root = os.path.expanduser("~/git/kconfig-files")
 
-    arg_parser = get_argument_parser(prog, default_config_root)
-    arg_config = arg_parser.parse_args(argv)
+    arg_config = parse_arguments(prog, argv, default_config_root)
+
+    def ensure_abspath(p):
+        # same result as os.path.abspath(),
+        # but no getcwd() call for absolute paths
+        return (os.path.normpath(p) if os.path.isabs(p) else os.path.abspath(p))
+    # ---
 
     src_dir    = arg_config.src or os.getcwd()
     build_info = BuildInfo(
-        src_dir     = os.path.abspath(src_dir),
-        build_dir   = os.path.abspath(arg_config.build or src_dir),
-        config_root = os.path.abspath(arg_config.config),
+        src_dir     = ensure_abspath(src_dir),
+        build_dir   = ensure_abspath(arg_config.build or src_dir),
+        config_root = ensure_abspath(arg_config.config),
     )
 
     arg_type = arg_config.type
     if arg_type:
-        arg_type = os.path.normpath(arg_type.lower().strip("/"))
+        arg_type = arg_type.lower()
+
+        if arg_type not in build_type_alias_map:
+            # custom type, used as config store subdir
+            arg_type = os.path.normpath(arg_type.strip("/"))
+    # --
 
     if not arg_type or arg_config == "auto":
         for btype_cls in build_type_map.values():
@@ -543,7 +953,6 @@ def main(prog, argv):
         or (arg_config.action == "config")
     ):
         build_type.prepare_src()
-        build_type.prepare_build()
         return build_type.run_config(getattr(arg_config, 'config_name', None))
 
     elif arg_config.action == "backup":
@@ -557,7 +966,109 @@ def main(prog, argv):
 # --- end of main (...) ---
 
 
+class ArgConfig(object):
+    __slots__ = [
+        "src", "build", "config", "type",
+        "action", "long", "config_name", "backup_name",
+    ]
+
+    def __init__(self, default_config_root):
+        super().__init__()
+        self.src         = None
+        self.build       = None
+        self.config      = default_config_root
+        self.type        = None
+        self.action      = None
+        self.long        = False
+        self.config_name = None
+        self.backup_name = None
+    # --- end of __init__ (...) ---
+
+# --- end of ArgConfig ---
+
+
+ARG_OPTIONS = {
+    "-S": "src",    "--src":    "src",
+    "-O": "build",  "--build":  "build",
+    "-C": "config", "--config": "config",
+    "-t": "type",   "--type":   "type",
+}
+
+ARG_ACTIONS = {
+    "list":   "list",   "l":  "list",
+    "config": "config", "co": "config",
+    "backup": "backup", "ci": "backup",
+}
+
+
+def parse_arguments(prog, argv, default_config_root):
+    # Minimal command line parser that handles the common cases
+    # without importing argparse.  Anything unusual (--help, unknown or
+    # abbreviated options, errors) is left to the argparse parser,
+    # which also takes care of printing help and usage messages.
+    def fallback():
+        arg_parser = get_argument_parser(prog, default_config_root)
+        return arg_parser.parse_args(argv)
+    # ---
+
+    arg_config = ArgConfig(default_config_root)
+    argv_iter  = iter(argv)
+
+    for arg in argv_iter:
+        if arg_config.action is None:
+            if arg in ARG_OPTIONS:
+                value = next(argv_iter, None)
+                if value is None or value[:1] == "-":
+                    # missing value, or option-like value
+                    return fallback()
+                setattr(arg_config, ARG_OPTIONS[arg], value)
+
+            elif arg in ARG_ACTIONS:
+                arg_config.action = ARG_ACTIONS[arg]
+
+            elif arg[:2] == "--":
+                key, sep, value = arg.partition("=")
+                if not sep or key not in ARG_OPTIONS:
+                    return fallback()
+                setattr(arg_config, ARG_OPTIONS[key], value)
+
+            elif arg[:2] in ARG_OPTIONS and arg[2:3] != "=":
+                # short option with attached value, e.g. "-Sdir"
+                # ("-S=dir" is left to argparse)
+                setattr(arg_config, ARG_OPTIONS[arg[:2]], arg[2:])
+
+            else:
+                return fallback()
+            # --
+
+        elif arg_config.action == "list":
+            if arg in {"-l", "--long"}:
+                arg_config.long = True
+            else:
+                return fallback()
+            # --
+
+        elif arg[:1] == "-":
+            return fallback()
+
+        elif arg_config.action == "config" and arg_config.config_name is None:
+            arg_config.config_name = arg
+
+        elif arg_config.action == "backup" and arg_config.backup_name is None:
+            arg_config.backup_name = arg
+
+        else:
+            return fallback()
+        # --
+    # --
+
+    return arg_config
+# --- end of parse_arguments (...) ---
+
+
 def get_argument_parser(prog, default_config_root):
+    import argparse
+
     prog_name = os.path.splitext(os.path.basename(prog))[0]
 
     arg_parser = argparse.ArgumentParser(